@@ -1,11 +1,17 @@
 import streamlit as st
-import pandas as pd
-import hashlib
+import blake3
 import re
 import base64
+import json
+import threading
+import shutil
 import requests
-import fitz  # PyMuPDF
 from io import BytesIO
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # --- 页面配置 ---
 st.set_page_config(
@@ -17,15 +23,6 @@ st.set_page_config(
 # --- CSS 美化 ---
 st.markdown("""
 <style>
-    .metric-card {
-        background-color: #f0f2f6;
-        border-radius: 10px;
-        padding: 20px;
-        text-align: center;
-        border: 1px solid #e0e0e0;
-    }
-    .metric-value { font-size: 28px; font-weight: bold; color: #1f77b4; }
-    .metric-label { color: #666; font-size: 14px; }
     .stDataFrame { border: 1px solid #eee; border-radius: 5px; }
     .stChatMessage { padding: 10px; border-radius: 5px; }
 </style>
@@ -33,78 +30,264 @@ st.markdown("""
 
 # --- 核心功能函数 ---
 
-def get_md5(file_bytes):
-    """计算文件 MD5"""
-    m = hashlib.md5()
-    m.update(file_bytes)
-    return m.hexdigest()
+@st.cache_resource
+def get_http_session():
+    """全局复用的 HTTP 会话 (连接池 + 自动重试)，避免每次请求重新握手"""
+    session = requests.Session()
+    # 只对幂等请求重试：大模型 POST 重发会重复计费并成倍拉长超时；
+    # 重试耗尽时返回原响应，由调用方按状态码报错
+    retry = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    return session
+
+_SESSION = get_http_session()
+
+_OCR_ERROR_PREFIXES = ("OCR API 错误", "OCR 请求异常")
+
+def _is_ocr_error(text):
+    """判断 OCR 结果是否为错误信息 (分块拼接后任一块失败即视为失败)"""
+    return text.startswith("❌") or any(prefix in text for prefix in _OCR_ERROR_PREFIXES)
+
+# 每个 OCR 请求最多包含的页数，以及每个请求的输出 token 上限 (不低于原先整份文档的 4096)
+OCR_CHUNK_PAGES = 8
+OCR_MAX_TOKENS = 4096
+# 使用 Qwen2-VL (视觉能力最强)
+OCR_MODEL = "Qwen/Qwen2-VL-72B-Instruct"
+OCR_PROMPT = "请识别以下所有图片中的文字，按顺序拼接，保持原有排版格式，输出 Markdown。"
+# PDF 渲染参数：2倍缩放以保证 OCR 清晰度；OCR 不需要无损图像，JPEG 体积远小于 PNG
+PDF_RENDER_ZOOM = 2
+PDF_JPEG_QUALITY = 85
+
+# OCR 结果磁盘缓存目录 (按 参数版本 / 文件哈希 + 页码范围 存储 Markdown)；
+# 模型、提示词或输出参数变化时版本号随之变化，旧结果不再命中
+OCR_CACHE_DIR = Path.home() / ".streamlit_cache" / "ocr"
+OCR_CACHE_VERSION = blake3.blake3(json.dumps(
+    [OCR_MODEL, OCR_PROMPT, OCR_MAX_TOKENS, PDF_RENDER_ZOOM, PDF_JPEG_QUALITY]
+).encode("utf-8")).hexdigest()[:16]
+# 进程内 OCR 缓存最多保留的分块数 (LRU 淘汰)
+OCR_MEMORY_CACHE_SIZE = 256
+
+# 9位数字学号
+_ID_RE = re.compile(r"\d{9}")
+
+# 批量批改时同时处理的作业份数；各份作业平分 OCR 并发数，
+# 总并发不超过单份作业时的设置 (也不超过连接池大小)
+BATCH_GRADE_WORKERS = 4
+
+def warm_up_connection(api_key):
+    """发送一个轻量请求，提前建立到 SiliconFlow 的连接并放入连接池"""
+    try:
+        _SESSION.head(
+            "https://api.siliconflow.cn/v1/models",
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=5
+        )
+    except Exception:
+        pass
+
+@st.cache_resource
+def get_ocr_memory_cache():
+    """进程内 OCR 结果缓存 (LRU，最多 OCR_MEMORY_CACHE_SIZE 条)，跨 rerun 共享"""
+    return {"entries": OrderedDict(), "lock": threading.Lock()}
+
+@st.cache_resource
+def prune_stale_ocr_cache(version):
+    """删除其他版本参数下的 OCR 磁盘缓存，每个版本每个进程只执行一次"""
+    if not OCR_CACHE_DIR.exists(): return
+    for path in OCR_CACHE_DIR.iterdir():
+        if path.name == version: continue
+        try:
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+        except OSError:
+            pass
+
+prune_stale_ocr_cache(OCR_CACHE_VERSION)
+
+def get_file_hash(file_bytes):
+    """计算文件 BLAKE3 哈希 (仅用于查重，比 MD5 快得多)"""
+    return blake3.blake3(file_bytes).hexdigest()
+
+def hash_file(f, chunk_size=1 << 20):
+    """分块读取文件对象计算 BLAKE3 哈希，不一次性复制整个文件"""
+    h = blake3.blake3()
+    f.seek(0)
+    while (block := f.read(chunk_size)):
+        h.update(block)
+    f.seek(0)
+    return h.hexdigest()
 
 def extract_id(text):
     """从字符串中提取9位数字学号"""
     if not isinstance(text, str):
         text = str(text)
-    match = re.search(r'\d{9}', text)
+    match = _ID_RE.search(text)
     return match.group() if match else None
 
-def get_pdf_images_base64(file_bytes):
-    """读取 PDF 的每一页，并转换为 Base64 图片列表"""
+def get_pdf_page_count(file_bytes):
+    """读取 PDF 页数 (只解析文档结构，不渲染页面)"""
+    # 延迟导入 PyMuPDF，未上传作业时不承担其加载开销
+    import fitz  # PyMuPDF
+    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+        return len(doc)
+
+# 仅内存缓存：OCR 文本已有独立磁盘缓存，渲染结果体积大，不落盘以保证 max_entries 生效
+@st.cache_data(show_spinner=False, max_entries=32)
+def get_pdf_images_base64(file_hash, _file_bytes):
+    """读取 PDF 的每一页，并转换为 Base64 图片列表
+
+    以文件哈希作为缓存键，_file_bytes 不参与缓存键计算，避免重复哈希整个文件。
+    """
+    # 延迟导入 PyMuPDF，未上传作业时不承担其加载开销
+    import fitz  # PyMuPDF
+    # 不在此捕获异常：失败结果不能进入缓存，由调用方报错
     images_b64 = []
-    try:
-        doc = fitz.open(stream=file_bytes, filetype="pdf")
+    with fitz.open(stream=_file_bytes, filetype="pdf") as doc:
         for page_num in range(len(doc)):
             page = doc[page_num]
-            # 2倍缩放以保证 OCR 清晰度
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            img_data = pix.tobytes("png")
+            pix = page.get_pixmap(matrix=fitz.Matrix(PDF_RENDER_ZOOM, PDF_RENDER_ZOOM))
+            img_data = pix.tobytes("jpeg", jpg_quality=PDF_JPEG_QUALITY)
             b64_str = base64.b64encode(img_data).decode("utf-8")
             images_b64.append(b64_str)
-        return images_b64
-    except Exception as e:
-        st.error(f"PDF 解析失败: {e}")
-        return []
-
-def call_vl_ocr(api_key, file_bytes, filename):
-    """调用视觉大模型进行 OCR (支持多页)"""
-    base64_list = []
-    if filename.lower().endswith('.pdf'):
-        base64_list = get_pdf_images_base64(file_bytes)
-        mime = "image/png"
-    else:
-        b64 = base64.b64encode(file_bytes).decode("utf-8")
-        base64_list = [b64]
-        mime = "image/jpeg"
-        
-    if not base64_list: return "❌ 无法读取文件图像"
+    return images_b64
+
+def _ocr_page_chunk(api_key, b64_imgs, mime):
+    """对一组连续页面 (不超过 OCR_CHUNK_PAGES 页) 调用视觉大模型进行 OCR
 
+    返回 (识别文本, 是否可缓存)；请求失败或输出因 max_tokens 被截断时不可缓存。
+    """
     url = "https://api.siliconflow.cn/v1/chat/completions"
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
     
-    content_payload = [{"type": "text", "text": "请识别以下所有图片中的文字，按顺序拼接，保持原有排版格式，输出 Markdown。"}]
-    for b64_img in base64_list:
+    content_payload = [{"type": "text", "text": OCR_PROMPT}]
+    for b64_img in b64_imgs:
         content_payload.append({
             "type": "image_url",
             "image_url": {"url": f"data:{mime};base64,{b64_img}"}
         })
 
-    # 使用 Qwen2-VL (视觉能力最强)
     payload = {
-        "model": "Qwen/Qwen2-VL-72B-Instruct",
+        "model": OCR_MODEL,
         "messages": [{"role": "user", "content": content_payload}],
         "temperature": 0.1,
-        "max_tokens": 4096 
+        "max_tokens": OCR_MAX_TOKENS
     }
     
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=180)
-        if resp.status_code != 200: return f"OCR API 错误 {resp.status_code}: {resp.text}"
-        return resp.json()['choices'][0]['message']['content']
+        resp = _SESSION.post(url, headers=headers, json=payload, timeout=180)
+        if resp.status_code != 200: return f"OCR API 错误 {resp.status_code}: {resp.text}", False
+        choice = resp.json()['choices'][0]
+        return choice['message']['content'], choice.get('finish_reason') != "length"
     except Exception as e:
-        return f"OCR 请求异常: {str(e)}"
+        return f"OCR 请求异常: {str(e)}", False
+
+def _ocr_cache_path(file_hash, page_range):
+    """OCR 分块结果的磁盘缓存路径"""
+    return OCR_CACHE_DIR / OCR_CACHE_VERSION / f"{file_hash}_{page_range[0]}-{page_range[1]}.md"
+
+def _read_ocr_cache(file_hash, page_range, mem_cache):
+    """查找 OCR 缓存，先查内存再查磁盘，未命中返回 None"""
+    cache_key = (OCR_CACHE_VERSION, file_hash, page_range)
+    with mem_cache["lock"]:
+        if cache_key in mem_cache["entries"]:
+            mem_cache["entries"].move_to_end(cache_key)
+            return mem_cache["entries"][cache_key]
+    cache_path = _ocr_cache_path(file_hash, page_range)
+    if not cache_path.exists():
+        return None
+    text = cache_path.read_text(encoding="utf-8")
+    _remember_ocr(cache_key, text, mem_cache)
+    return text
+
+def _write_ocr_cache(file_hash, page_range, text, mem_cache):
+    """写入 OCR 缓存 (内存 + 磁盘)"""
+    _remember_ocr((OCR_CACHE_VERSION, file_hash, page_range), text, mem_cache)
+    cache_path = _ocr_cache_path(file_hash, page_range)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(text, encoding="utf-8")
+    except OSError:
+        pass
+
+def _remember_ocr(cache_key, text, mem_cache):
+    """写入进程内 LRU 缓存，超出容量时淘汰最久未使用的条目"""
+    with mem_cache["lock"]:
+        entries = mem_cache["entries"]
+        entries[cache_key] = text
+        entries.move_to_end(cache_key)
+        while len(entries) > OCR_MEMORY_CACHE_SIZE:
+            entries.popitem(last=False)
+
+def call_vl_ocr(api_key, file_bytes, filename, max_workers=8):
+    """调用视觉大模型进行 OCR (按每 8 页分块并发识别，按页码顺序拼接)"""
+    file_hash = get_file_hash(file_bytes)
+    is_pdf = filename.lower().endswith('.pdf')
+    try:
+        page_count = get_pdf_page_count(file_bytes) if is_pdf else 1
+    except Exception as e:
+        return f"❌ PDF 解析失败: {e}"
+    if not page_count: return "❌ 无法读取文件图像"
+
+    # 先查缓存，全部命中时无需渲染页面
+    mem_cache = get_ocr_memory_cache()
+    page_ranges = [(start, min(start + OCR_CHUNK_PAGES, page_count)) for start in range(0, page_count, OCR_CHUNK_PAGES)]
+    chunks = {r: _read_ocr_cache(file_hash, r, mem_cache) for r in page_ranges}
+    missing = [r for r in page_ranges if chunks[r] is None]
+
+    if missing:
+        if is_pdf:
+            try:
+                base64_list = get_pdf_images_base64(file_hash, file_bytes)
+            except Exception as e:
+                return f"❌ PDF 解析失败: {e}"
+            mime = "image/jpeg"
+        else:
+            base64_list = [base64.b64encode(file_bytes).decode("utf-8")]
+            mime = "image/jpeg"
 
-def call_ai_grader(api_key, content):
-    """调用 API 进行评分 (Qwen2.5)"""
+        def ocr_chunk(page_range):
+            start, end = page_range
+            text, cacheable = _ocr_page_chunk(api_key, base64_list[start:end], mime)
+            # 失败或被截断的结果不缓存，下次点击可重试
+            if cacheable:
+                _write_ocr_cache(file_hash, page_range, text, mem_cache)
+            return text
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            chunks.update(zip(missing, executor.map(ocr_chunk, missing)))
+
+    return "\n\n---\n\n".join(chunks[r] for r in page_ranges)
+
+def _stream_chat_completion(api_key, payload, timeout):
+    """以 SSE 流式方式调用对话接口，逐段产出模型回复；非 200 响应抛出 HTTPError"""
     url = "https://api.siliconflow.cn/v1/chat/completions"
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    payload = {**payload, "stream": True}
+    with _SESSION.post(url, headers=headers, json=payload, stream=True, timeout=timeout) as resp:
+        if resp.status_code != 200:
+            raise requests.HTTPError(f"API 报错 {resp.status_code}: {resp.text}", response=resp)
+        for line in resp.iter_lines():
+            # SSE 格式: "data: {...}"，以 "data: [DONE]" 结束
+            if not line: continue
+            line = line.decode("utf-8")
+            if not line.startswith("data: "): continue
+            data = line[len("data: "):]
+            if data.strip() == "[DONE]": break
+            chunk = json.loads(data)
+            if not chunk.get("choices"): continue
+            yield chunk["choices"][0]["delta"].get("content") or ""
+
+def call_ai_grader_stream(api_key, content):
+    """调用 API 进行评分 (Qwen2.5)，流式返回；失败时抛出异常，避免把错误信息当作评语"""
     payload = {
         "model": "Qwen/Qwen2.5-72B-Instruct",
         "messages": [
@@ -112,27 +295,93 @@ def call_ai_grader(api_key, content):
             {"role": "user", "content": f"请对以下作业进行评分(0-100)并给出简短评语：\n\n{content}"}
         ]
     }
-    try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=60)
-        return resp.json()['choices'][0]['message']['content']
-    except:
-        return "评分服务超时或失败"
+    yield from _stream_chat_completion(api_key, payload, timeout=60)
 
-def call_chat_bot(api_key, messages):
-    """调用 API 进行对话 (Qwen2.5)"""
-    url = "https://api.siliconflow.cn/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+def call_ai_grader(api_key, content):
+    """调用 API 进行评分 (Qwen2.5)，返回完整评语；失败时抛出异常"""
+    return "".join(call_ai_grader_stream(api_key, content))
+
+def call_chat_bot_stream(api_key, messages):
+    """调用 API 进行对话 (Qwen2.5)，流式返回"""
     payload = {
         "model": "Qwen/Qwen2.5-72B-Instruct",
-        "messages": messages,
-        "stream": False 
+        "messages": messages
     }
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=60)
-        if resp.status_code != 200: return f"API 报错: {resp.text}"
-        return resp.json()['choices'][0]['message']['content']
+        yield from _stream_chat_completion(api_key, payload, timeout=60)
+    except Exception as e:
+        yield f"对话连接失败: {str(e)}"
+
+def grade_pipeline(api_key, file_bytes, filename, ocr_workers=8, grader=call_ai_grader):
+    """OCR + 评分完整流程，返回 (识别内容, 评语, 错误信息)；任一步失败时评语为 None"""
+    ocr_res = call_vl_ocr(api_key, file_bytes, filename, ocr_workers)
+    if _is_ocr_error(ocr_res):
+        return ocr_res, None, ocr_res
+    try:
+        eval_res = grader(api_key, ocr_res)
     except Exception as e:
-        return f"对话连接失败: {str(e)}"
+        return ocr_res, None, f"评分服务超时或失败: {e}"
+    return ocr_res, eval_res, None
+
+@st.cache_data(show_spinner=False)
+def parse_roster(xlsx_bytes):
+    """解析花名册，返回 (学号->姓名 字典, 全部学号集合)"""
+    # 延迟导入 pandas，上传花名册之前不承担其加载开销
+    import pandas as pd
+    df_roster = pd.read_excel(BytesIO(xlsx_bytes), dtype=str).fillna("")
+    # 按列取值后 zip 成行，避免 iterrows 逐行构造 Series
+    columns = [df_roster.iloc[:, i] for i in range(df_roster.shape[1])]
+    roster_dict = {} 
+    for row in zip(*columns):
+        # 逐格查找学号，命中即停，无需拼接整行字符串
+        sid = None
+        for item in row:
+            match = _ID_RE.search(item)
+            if match:
+                sid = match.group()
+                break
+        if not sid: continue
+        name = "未知姓名"
+        for item in row:
+            item = item.strip()
+            if item != sid and not item.isdigit() and len(item) >= 2:
+                name = item
+                break
+        roster_dict[sid] = name
+    return roster_dict, set(roster_dict.keys())
+
+@st.cache_data(show_spinner=False)
+def parse_homework(homework_meta, roster_dict, _homework_files):
+    """解析作业文件，返回 (有效文件名集合, 哈希分组, 空文件列表, 已交学号集合)
+
+    homework_meta 为 (file_id, 文件名, 大小) 元组，作为缓存键；
+    _homework_files 为对应的上传文件对象，不参与缓存键计算，仅在哈希时读取。
+    """
+    valid_names = set()
+    md5_map = {}
+    empty_files = []
+    submitted_ids = set()
+    size_groups = {}
+    for (_, fname, f_size), f in zip(homework_meta, _homework_files):
+        if fname.startswith("~$") or fname.startswith("."): continue
+        sid = extract_id(fname)
+        if sid and sid in roster_dict:
+            valid_names.add(fname)
+            submitted_ids.add(sid)
+            if f_size < 100:
+                empty_files.append({"学号": sid, "姓名": roster_dict[sid], "文件名": fname, "大小": f"{f_size}B"})
+            else:
+                if f_size not in size_groups: size_groups[f_size] = []
+                size_groups[f_size].append((sid, fname, f))
+
+    # 大小不同的文件不可能完全相同，只对大小撞车的文件计算哈希
+    for group in size_groups.values():
+        if len(group) < 2: continue
+        for sid, fname, f in group:
+            f_hash = hash_file(f)
+            if f_hash not in md5_map: md5_map[f_hash] = []
+            md5_map[f_hash].append((sid, fname))
+    return valid_names, md5_map, empty_files, submitted_ids
 
 # --- 主程序逻辑 ---
 
@@ -149,6 +398,12 @@ with st.sidebar:
     
     if not api_key:
         st.warning("⚠️ 请先输入 API Key 才能使用 AI 功能")
+    elif not st.session_state.setdefault("_warmed", False):
+        # 后台预热 HTTPS 连接，首次调用 API 时无需再等待 TCP/TLS 握手
+        threading.Thread(target=warm_up_connection, args=(api_key,), daemon=True).start()
+        st.session_state._warmed = True
+    
+    ocr_workers = st.slider("OCR 并发请求数", min_value=1, max_value=16, value=8, help="同时发送的 OCR 请求数量 (每个请求最多 8 页)")
     
     st.divider()
     
@@ -166,20 +421,7 @@ if not roster_file:
 
 # 1. 处理花名册
 try:
-    df_roster = pd.read_excel(roster_file, dtype=str)
-    roster_dict = {} 
-    for idx, row in df_roster.iterrows():
-        row_str = " ".join(row.fillna("").astype(str).values)
-        sid = extract_id(row_str)
-        if sid:
-            name = "未知姓名"
-            for item in row.values:
-                item = str(item).strip()
-                if item != sid and not item.isdigit() and len(item) >= 2:
-                    name = item
-                    break
-            roster_dict[sid] = name
-    all_students = set(roster_dict.keys())
+    roster_dict, all_students = parse_roster(roster_file.getvalue())
     if not all_students:
         st.error("❌ 花名册读取失败：未找到任何9位学号。")
         st.stop()
@@ -188,39 +430,26 @@ except Exception as e:
     st.stop()
 
 # 2. 处理作业文件
-submitted_data = []
 files_map = {}
 md5_map = {}
 empty_files = []
+submitted_ids = set()
 
 if homework_files:
-    for f in homework_files:
-        fname = f.name
-        if fname.startswith("~$") or fname.startswith("."): continue
-        sid = extract_id(fname)
-        if sid and sid in all_students:
-            files_map[fname] = f
-            f_bytes = f.getvalue()
-            f_size = f.size
-            submitted_data.append(sid)
-            if f_size < 100:
-                empty_files.append({"学号": sid, "姓名": roster_dict[sid], "文件名": fname, "大小": f"{f_size}B"})
-            else:
-                f_md5 = get_md5(f_bytes)
-                if f_md5 not in md5_map: md5_map[f_md5] = []
-                md5_map[f_md5].append((sid, fname))
+    homework_meta = tuple((f.file_id, f.name, f.size) for f in homework_files)
+    valid_names, md5_map, empty_files, submitted_ids = parse_homework(homework_meta, roster_dict, homework_files)
+    files_map = {f.name: f for f in homework_files if f.name in valid_names}
 
 # 3. 统计计算
-submitted_ids = set(submitted_data)
 missing_ids = all_students - submitted_ids
 submit_rate = round(len(submitted_ids) / len(all_students) * 100, 1)
 
 # 4. 显示顶部指标
 c1, c2, c3, c4 = st.columns(4)
-c1.markdown(f"<div class='metric-card'><div class='metric-value'>{len(all_students)}</div><div class='metric-label'>应交人数</div></div>", unsafe_allow_html=True)
-c2.markdown(f"<div class='metric-card'><div class='metric-value'>{len(submitted_ids)}</div><div class='metric-label'>实交人数</div></div>", unsafe_allow_html=True)
-c3.markdown(f"<div class='metric-card'><div class='metric-value' style='color:#d62728'>{len(missing_ids)}</div><div class='metric-label'>未交人数</div></div>", unsafe_allow_html=True)
-c4.markdown(f"<div class='metric-card'><div class='metric-value'>{submit_rate}%</div><div class='metric-label'>提交率</div></div>", unsafe_allow_html=True)
+c1.metric("应交人数", len(all_students))
+c2.metric("实交人数", len(submitted_ids))
+c3.metric("未交人数", len(missing_ids))
+c4.metric("提交率", f"{submit_rate}%")
 
 st.write("") 
 
@@ -278,8 +507,17 @@ with tab3:
         if "last_sel_file" not in st.session_state:
             st.session_state.last_sel_file = sel_file
         
+        # 批量结果按 file_id 存储：重新上传同名文件会得到新 file_id，不会载入旧结果；
+        # 已移除的文件的结果随之清理
+        current_file_ids = {files_map[n].file_id for n in pdf_candidates}
+        st.session_state.batch_results = {
+            k: v for k, v in st.session_state.get("batch_results", {}).items() if k in current_file_ids
+        }
+        sel_file_id = files_map[sel_file].file_id
+
         if st.session_state.last_sel_file != sel_file:
-            st.session_state.current_analysis = None
+            # 若该作业已批量批改过，直接载入结果
+            st.session_state.current_analysis = st.session_state.batch_results.get(sel_file_id)
             st.session_state.chat_messages = []
             st.session_state.last_sel_file = sel_file
 
@@ -292,27 +530,65 @@ with tab3:
         # 只有当用户输入了 key 时才显示可点击的按钮
         if api_key:
             if st.button("🚀 开始全页分析", type="primary"):
-                target_f = files_map[sel_file]
-                target_f.seek(0)
-                file_data = target_f.read()
+                file_data = files_map[sel_file].getvalue()
                 
+                def stream_grader(api_key, ocr_res):
+                    st.write("🧠 正在评分 (Qwen2.5)...")
+                    return st.write_stream(call_ai_grader_stream(api_key, ocr_res))
+
                 with st.status("AI 正在全力处理...", expanded=True) as status:
                     st.write("👀 正在阅读作业所有页面 (多页OCR)...")
-                    ocr_res = call_vl_ocr(api_key, file_data, sel_file)
+                    ocr_res, eval_res, error = grade_pipeline(api_key, file_data, sel_file, ocr_workers, grader=stream_grader)
                     
-                    if "❌" in ocr_res or "API 错误" in ocr_res:
+                    if error:
                         status.update(label="处理失败", state="error")
-                        st.error(ocr_res)
+                        st.error(error)
                     else:
-                        st.write("🧠 正在评分 (Qwen2.5)...")
-                        eval_res = call_ai_grader(api_key, ocr_res)
-                        status.update(label="分析完成", state="complete")
+                        status.update(label="分析完成", state="complete", expanded=False)
                         
                         st.session_state.current_analysis = {
                             "ocr": ocr_res,
                             "eval": eval_res
                         }
                         st.session_state.chat_messages = []
+
+            if st.button(f"📚 批量批改全部 ({len(pdf_candidates)} 份)"):
+                progress = st.progress(0.0, text="批量批改中...")
+                failed = []
+                # 平分并发额度，避免 批量数 x 单份并发 超出连接池
+                per_file_ocr_workers = max(1, ocr_workers // BATCH_GRADE_WORKERS)
+                with ThreadPoolExecutor(max_workers=BATCH_GRADE_WORKERS) as executor:
+                    futures = {
+                        executor.submit(
+                            grade_pipeline, api_key, files_map[n].getvalue(), n, per_file_ocr_workers
+                        ): n
+                        for n in pdf_candidates
+                    }
+                    for done, future in enumerate(as_completed(futures), 1):
+                        fname = futures[future]
+                        try:
+                            ocr_res, eval_res, error = future.result()
+                        except Exception as e:
+                            ocr_res, eval_res, error = None, None, f"处理异常: {e}"
+                        if error:
+                            failed.append(f"{fname} ({error[:80]})")
+                        else:
+                            st.session_state.batch_results[files_map[fname].file_id] = {
+                                "name": fname, "ocr": ocr_res, "eval": eval_res
+                            }
+                        progress.progress(done / len(futures), text=f"批量批改中... ({done}/{len(futures)})")
+                progress.empty()
+                if failed:
+                    st.error("以下作业处理失败：\n\n" + "\n\n".join(failed))
+                st.session_state.current_analysis = st.session_state.batch_results.get(sel_file_id)
+                st.session_state.chat_messages = []
+
+            if st.session_state.batch_results:
+                with st.expander(f"📑 批量批改结果 (共 {len(st.session_state.batch_results)} 份，可在上方选择作业查看详情)"):
+                    for result in st.session_state.batch_results.values():
+                        st.markdown(f"**{result['name']}**")
+                        st.markdown(result["eval"])
+                        st.divider()
         else:
             st.error("🔒 请先在左侧侧边栏输入 SiliconFlow API Key 才能开始分析")
 
@@ -324,7 +600,10 @@ with tab3:
             c_left, c_right = st.columns(2)
             with c_left:
                 st.markdown("#### 📄 作业识别内容 (全部页面)")
-                st.text_area("", data["ocr"], height=300, disabled=True)
+                # 只读内容用 Markdown 展示，替代可编辑的大文本框；默认折叠以免长文本占满页面
+                # (注意：折叠的 expander 内容每次 rerun 仍会发送到前端)
+                with st.expander("展开识别内容", expanded=False):
+                    st.markdown(data["ocr"])
             with c_right:
                 st.markdown("#### 📝 评价报告")
                 st.markdown(data["eval"])
@@ -359,9 +638,7 @@ with tab3:
                     api_messages = [{"role": "system", "content": system_prompt}] + st.session_state.chat_messages
 
                     with st.chat_message("assistant"):
-                        with st.spinner("思考中..."):
-                            response = call_chat_bot(api_key, api_messages)
-                            st.markdown(response)
+                        response = st.write_stream(call_chat_bot_stream(api_key, api_messages))
                     
                     st.session_state.chat_messages.append({"role": "assistant", "content": response})
 